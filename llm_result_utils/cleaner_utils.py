@@ -1,41 +1,90 @@
-from typing import Optional, Tuple, List
+from typing import Any, Callable, NamedTuple, Optional, Sequence, Tuple, List, Union
+import codecs
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import re
+import socket
+import sys
+import time
+from urllib import error as urllib_error
+from urllib import parse as urllib_parse
 from urllib import request as urllib_request
 import unicodedata
 import json
+import logging
 
+from llm_result_utils.text_utils import TextUtils
 
-class CleanerUtils(object):
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+class _Swap(NamedTuple):
+    pattern: re.Pattern[str]
+    replacement: str
+    # Casefolded literal that must be present for the pattern to match, if known.
+    needle: Optional[str]
+    # Whether the needle is everything the pattern matches.
+    is_literal: bool
+    # Literal without cased characters which can be swapped with str.replace.
+    plain: Optional[str]
+    # RE2 version of the pattern for ASCII text, when google-re2 is installed.
+    fast_pattern: Any
+
+
+class _ControlCharacterTable(dict):
+    """
+    str.translate table which drops control characters other than newlines. Entries
+    are filled in the first time a character is seen rather than for all of Unicode.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        # Nearly everything we see is mostly ASCII so fill that in up front.
+        for codepoint in range(128):
+            self.__missing__(codepoint)
+
+    def __missing__(self, codepoint: int) -> Optional[int]:
+        if codepoint != 0x0A and unicodedata.category(chr(codepoint))[0] == "C":
+            self[codepoint] = None
+        else:
+            self[codepoint] = codepoint
+        return self[codepoint]
+
+
+class CleanerUtils(TextUtils):
     """Utils for cleaning up responses from large language models."""
 
-    tla_regex = re.compile("([A-Z])\\w+ ([A-Z])\\w+ ([A-Z])\\w+ \\(([A-Z]{3})\\)")
-    note_regex = re.compile(r"\n\s*\**\s*Note.*\Z")
     key_compliance_notes_regex = re.compile(
         r"\*\*Key Compliance Notes\*\*.*\Z", re.DOTALL
     )
     why_this_works_regex = re.compile(r"### \*\*Why This Works\*\*.*\Z", re.DOTALL)
 
-    @classmethod
-    def tla_fixer(cls, result: Optional[str]) -> Optional[str]:
-        """Fix incorrectly identified TLAs (Three Letter Acronyms) in text."""
-        if result is None:
-            return None
-
-        # Look for three letter acronyms
-        matches = cls.tla_regex.finditer(result)
-        for m in matches:
-            tla = m.group(1) + m.group(2) + m.group(3)
-            if tla != m.group(4):
-                # Swap the bad TLA.
-                result = re.sub(f"(?<=[\\.\\( ]){m.group(4)}", tla, result)
-        return result
-
     @classmethod
     def note_remover(cls, result: Optional[str]) -> Optional[str]:
         """Remove the last line note because we'll put similar content up earlier anyways"""
         if result is None:
             return None
-        result = cls.note_regex.sub("", result)
+        # All three tails need one of these, and most responses have none of them.
+        # "Key Compliance Notes" is covered by "Note".
+        if "Note" not in result and "Why This Works" not in result:
+            return result
+        if "Note" in result:
+            result = cls.note_regex.sub("", result)
         result = cls.key_compliance_notes_remover(result)
         result = cls.why_this_works_remover(result)
         return result
@@ -45,6 +94,8 @@ class CleanerUtils(object):
         """Remove anything after '**Key Compliance Notes**:'"""
         if result is None:
             return None
+        if "**Key Compliance Notes**" not in result:
+            return result
         return cls.key_compliance_notes_regex.sub("", result)
 
     @classmethod
@@ -52,6 +103,8 @@ class CleanerUtils(object):
         """Remove anything after '### **Why This Works**'"""
         if result is None:
             return None
+        if "### **Why This Works**" not in result:
+            return result
         return cls.why_this_works_regex.sub("", result)
 
     @classmethod
@@ -69,7 +122,7 @@ class CleanerUtils(object):
         return result
 
     # Different swaps for different types of responses.
-    swaps: dict[str, list[Tuple[str, str]]] = {
+    swaps: dict[str, Sequence[Tuple[str, str]]] = {
         "general": [
             (
                 "Note that the information is inferred based on the reviewer's findings, but the language used is general rather than directly referencing the reviewer's findings.",
@@ -228,39 +281,343 @@ class CleanerUtils(object):
             (r"Dear \[Medical Necessity\]", "Dear [Insurance Company],"),
             ("to the independent medical review findings", "to your decision"),
             ("Thank you for providing me with this information.", ""),
-            ("The independent medical review findings of.*?:", ""),
+            (r"The independent medical review findings of[^:\n]*:", ""),
             ("According to the independent medical review, ", ""),
             ("Hence,  concluded", ""),
         ],
     }
 
+    # Compiled form of swaps, built once by _init_swaps.
+    _compiled_swaps: dict[str, Tuple[_Swap, ...]] = {}
+
+    # Characters IGNORECASE matches against an ASCII letter which casefold() leaves alone.
+    _casefold_fixups = {0x130: "i", 0x131: "i"}
+
+    # General plus type specific swaps, filled in as types are used.
+    _merged_swaps: dict[str, Tuple[_Swap, ...]] = {}
+
+    # Per type automaton over the swap needles, when pyahocorasick is installed.
+    _swap_automatons: dict[str, "ahocorasick.Automaton"] = {}
+
+    # Per type function generated by _build_swap_runner.
+    _swap_runners: dict[str, Callable[[str], str]] = {}
+
+    # The swaps table and its entries as of the last _init_swaps.
+    _swap_table: dict = {}
+    _swap_sources: dict = {}
+
+    @classmethod
+    def _init_swaps(cls) -> None:
+        """Compile the swap patterns so cleanup_lt doesn't re-parse them on every call."""
+        # Freeze the lists so they can't change behind the compiled copy's back. Entries
+        # added or replaced later are picked up by _sync_swaps.
+        cls.swaps = {lt: tuple(items) for lt, items in cls.swaps.items()}
+        cls._swap_table = cls.swaps
+        cls._swap_sources = dict(cls.swaps)
+        cls._compiled_swaps = {
+            lt: tuple(cls._compile_swap(o, r) for o, r in items)
+            for lt, items in cls.swaps.items()
+        }
+        cls._merged_swaps = {}
+        cls._swap_automatons = {}
+        cls._swap_runners = {}
+        cls._cleanup_lt_impl.cache_clear()
+        if ahocorasick is not None:
+            general = cls._compiled_swaps["general"]
+            for lt, compiled in cls._compiled_swaps.items():
+                needles = {s.needle for s in general + compiled if s.needle}
+                # pyahocorasick can't search with an empty automaton, and there's
+                # nothing for it to find anyway.
+                if not needles:
+                    continue
+                automaton = ahocorasick.Automaton()
+                for needle in needles:
+                    automaton.add_word(needle, needle)
+                automaton.make_automaton()
+                cls._swap_automatons[lt] = automaton
+
+    @classmethod
+    def _sync_swaps(cls, lt: str) -> None:
+        """Recompile the swaps if the ones lt uses were changed since _init_swaps."""
+        swaps = cls.swaps
+        sources = cls._swap_sources
+        if (
+            swaps is not cls._swap_table
+            or swaps.get(lt) is not sources.get(lt)
+            or swaps.get("general") is not sources.get("general")
+        ):
+            cls._init_swaps()
+
+    @classmethod
+    def _compile_swap(cls, pattern: str, replacement: str) -> _Swap:
+        needle = None
+        plain = None
+        literal = cls._literal_pattern(pattern)
+        # Only ASCII literals get the fast path so that _fold is exact for them.
+        if literal and literal.isascii():
+            needle = literal.lower()
+            # Without any cased characters IGNORECASE is a no-op and str.replace is identical.
+            if literal.lower() == literal.upper() and "\\" not in replacement:
+                plain = literal
+        else:
+            literal = None
+            # Regexes still can't match without their longest run of literal text.
+            required = cls._required_literal(pattern)
+            if required:
+                needle = required.lower()
+        fast_pattern = None
+        if "\\" not in replacement:
+            fast_pattern = cls._compile_re2(pattern)
+        return _Swap(
+            re.compile(pattern, re.IGNORECASE),
+            replacement,
+            needle,
+            literal is not None,
+            plain,
+            fast_pattern,
+        )
+
+    @classmethod
+    def _required_literal(cls, pattern: str) -> Optional[str]:
+        """
+        Find the longest run of literal ASCII text which every match of pattern contains.
+        Anything this doesn't understand breaks the run, so it may come up short.
+        """
+        if re.compile(pattern).flags & re.VERBOSE:
+            return None
+        # Literal characters the pattern must match in order, None for anything else.
+        atoms: list[Optional[str]] = []
+        i = 0
+        while i < len(pattern):
+            ch = pattern[i]
+            if ch == "\\":
+                escape = pattern[i + 1 : i + 2]
+                if escape and escape in "sSdDwWbBAZ":
+                    # \s, \d, \b and friends aren't literal text
+                    atoms.append(None)
+                elif not escape or escape.isalnum():
+                    # \x41, \101, \1 and the like carry on past the next character, so
+                    # stop at the longest run so far rather than misread the rest.
+                    atoms.append(None)
+                    break
+                else:
+                    atoms.append(escape)
+                i += 2
+            elif ch in "([":
+                atoms.append(None)
+                i = cls._skip_group(pattern, i)
+            elif ch == "|":
+                return None
+            elif ch in "*?+{":
+                if ch == "{":
+                    i = pattern.find("}", i)
+                    if i == -1:
+                        atoms.append(None)
+                        break
+                i += 1
+                # Lazy and possessive versions
+                if pattern.startswith(("?", "+"), i):
+                    i += 1
+                if atoms and atoms[-1] is not None:
+                    if ch == "+":
+                        # Still required but may repeat so the run stops after it
+                        atoms.append(None)
+                    else:
+                        atoms[-1] = None
+            elif ch in ".^$":
+                atoms.append(None)
+                i += 1
+            else:
+                atoms.append(ch)
+                i += 1
+        best = ""
+        run = ""
+        for atom in atoms + [None]:
+            # Only ASCII needles can be checked against the folded text
+            if atom is None or not atom.isascii():
+                best = max(best, run, key=len)
+                run = ""
+            else:
+                run += atom
+        return best or None
+
+    @classmethod
+    def _skip_group(cls, pattern: str, i: int) -> int:
+        """Return the index just past the group or character class starting at i."""
+        depth = 0
+        in_class = False
+        while i < len(pattern):
+            ch = pattern[i]
+            if ch == "\\":
+                i += 2
+                continue
+            if in_class:
+                if ch == "]":
+                    in_class = False
+            elif ch == "[":
+                in_class = True
+                # A leading ] (after an optional ^) is part of the class
+                if pattern.startswith("^", i + 1):
+                    i += 1
+                if pattern.startswith("]", i + 1):
+                    i += 1
+            elif ch == "(":
+                depth += 1
+            elif ch == ")":
+                depth -= 1
+            i += 1
+            if depth == 0 and not in_class:
+                return i
+        return i
+
+    # Python's \s on ASCII, RE2's version is missing \v and \x1c-\x1f.
+    _re2_whitespace = r"[\t\n\x0b\x0c\r\x1c-\x1f ]"
+
+    @classmethod
+    def _compile_re2(cls, pattern: str) -> Any:
+        """
+        Compile pattern with RE2 so that it matches the same as re on ASCII text.
+        Returns None without google-re2 or for patterns RE2 would treat differently.
+        """
+        translated = cls._re2_pattern(pattern)
+        if re2 is None or translated is None:
+            return None
+        options = re2.Options()
+        options.case_sensitive = False
+        options.log_errors = False
+        try:
+            return re2.compile(translated, options)
+        except re2.error:
+            return None
+
+    @classmethod
+    def _re2_pattern(cls, pattern: str) -> Optional[str]:
+        """
+        Translate a swap pattern to RE2 syntax with the same meaning on ASCII text,
+        or None if there isn't a simple translation.
+        """
+        translated = []
+        i = 0
+        in_class = False
+        while i < len(pattern):
+            ch = pattern[i]
+            if ch == "\\" and i + 1 < len(pattern):
+                escape = pattern[i + 1]
+                if escape == "s" and not in_class:
+                    translated.append(cls._re2_whitespace)
+                elif escape in "sS":
+                    return None
+                else:
+                    translated.append(ch + escape)
+                i += 2
+                continue
+            if ch == "[" and not in_class:
+                in_class = True
+                # A leading ] (after an optional ^) is part of the class
+                start = i + 1
+                if pattern.startswith("^", start):
+                    start += 1
+                if pattern.startswith("]", start):
+                    start += 1
+                translated.append(pattern[i:start])
+                i = start
+                continue
+            elif ch == "]" and in_class:
+                in_class = False
+            elif ch == "$" and not in_class:
+                # RE2 doesn't match $ before a trailing newline
+                return None
+            translated.append(ch)
+            i += 1
+        return "".join(translated)
+
+    @classmethod
+    def _literal_pattern(cls, pattern: str) -> Optional[str]:
+        """Return the text a pattern matches if it doesn't use any regex features."""
+        literal = []
+        escaped = False
+        for ch in pattern:
+            if escaped:
+                # \s, \d, \1 and friends aren't literals
+                if ch.isalnum():
+                    return None
+                literal.append(ch)
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch in ".^$*+?{}[]()|":
+                return None
+            else:
+                literal.append(ch)
+        if escaped:
+            return None
+        return "".join(literal)
+
+    @classmethod
+    def _fold(cls, data: str) -> str:
+        """
+        Case fold data so that anything an ASCII literal matches with IGNORECASE
+        is a plain substring of the result.
+        """
+        if data.isascii():
+            return data.lower()
+        # translate with a dict is slow, so only use it when it has something to do.
+        if "\u0130" in data or "\u0131" in data:
+            data = data.translate(cls._casefold_fixups)
+        return data.casefold()
+
+    @classmethod
+    def _present_needles(cls, folded: str, automaton=None):
+        """
+        Find which swap needles occur in the folded text. The result only supports `in`:
+        with an automaton it is the set of needles found in one pass, otherwise the text.
+        """
+        if automaton is None:
+            return folded
+        return {needle for _, needle in automaton.iter(folded)}
+
+    @classmethod
+    def _replace_literal(
+        cls, data: str, folded: str, needle: str, replacement: str
+    ) -> Tuple[str, str]:
+        """
+        Replace every occurrence of needle (found in folded) in ASCII data with an
+        ASCII replacement. folded gets the same edit so it doesn't need folding again.
+        """
+        kept = []
+        start = 0
+        pos = folded.find(needle)
+        while pos != -1:
+            kept.append((start, pos))
+            start = pos + len(needle)
+            pos = folded.find(needle, start)
+        kept.append((start, len(data)))
+        return (
+            replacement.join([data[a:b] for a, b in kept]),
+            replacement.lower().join([folded[a:b] for a, b in kept]),
+        )
+
+    _control_character_table = _ControlCharacterTable()
+
     @classmethod
     def remove_control_characters(cls, s):
         """Remove control characters from the given string, except for newlines."""
-        return "".join(
-            ch for ch in s if unicodedata.category(ch)[0] != "C" or ch == "\n"
-        )
+        # Control characters aren't printable, so text which is printable apart from
+        # newlines has nothing to remove. That check runs in C and translate doesn't
+        # for non-ASCII text.
+        if s.replace("\n", " ").isprintable():
+            return s
+        return s.translate(cls._control_character_table)
 
     @classmethod
     def json_fix_missing_quotes(cls, json_string):
         """Fix missing quotes around JSON keys and unquoted values."""
-        # Find all JSON keys without quotes (no spaces allowed in keys)
-        pattern_keys = r"([{,])\s*([a-zA-Z_]\w*)\s*:"
-        fixed_json = re.sub(pattern_keys, r' \1"\2":', json_string)
-
-        # Find all JSON values without quotes (including null) and spaces allowed in values
-        pattern_values = r'(?<=[{,])\s*([a-zA-Z_]\w*)\s*:\s*([^,"}\]]+|null)'
-        fixed_json = re.sub(pattern_values, r' "\1": \2', fixed_json)
-
-        return fixed_json
+        return cls.fix_missing_quotes(json_string)
 
     @classmethod
     def json_fix_missing_colons(cls, json_string):
         """Fix missing colons in JSON strings."""
-        # Find all places where a colon is missing between keys and values
-        pattern = r'([{,])\s*([a-zA-Z_]\w*)\s+([^",}\]]+)'
-        fixed_json = re.sub(pattern, r' \1"\2": \3', json_string)
-        return fixed_json
+        return cls.fix_missing_colons(json_string)
 
     @classmethod
     def cleanup_json(cls, data):
@@ -270,7 +627,8 @@ class CleanerUtils(object):
         """
 
         # Some models get None and null mixed up in their JSON output
-        data = data.replace("None", "null")
+        if "None" in data:
+            data = cls.json_none_token_regex.sub(cls._none_to_null, data)
         data = cls.remove_control_characters(data)
 
         # Try and clean up the endings
@@ -278,28 +636,99 @@ class CleanerUtils(object):
             data = data.rstrip(",")
         data = data.replace(",}", "}")
 
-        # Handle some missing quotes if needed.
         try:
-            return json.loads(data)
-        except:
-            data = cls.fix_missing_quotes(data)
-
-        try:
-            return json.loads(data)
-        except:
-            pass
-        try:
-            return json.loads(data + "}")
-        except:
+            return cls._json_loads(data)
+        except (ValueError, RecursionError):
             pass
 
-        try:
-            return json.loads(data + '"}')
-        except:
-            pass
+        # Handle some missing quotes if needed, leaving the insides of strings alone
+        # first and then falling back to quoting anything which looks like a key.
+        repaired = cls._json_repair_scan(data)
+        attempts = [repaired]
+        fallback = cls.fix_missing_quotes(data)
+        if fallback != repaired:
+            attempts.append(fallback)
+        for attempt in attempts:
+            # Records are often cut off so try closing them too.
+            for ending in ["", "}", '"}']:
+                try:
+                    return cls._json_loads(attempt + ending)
+                except (ValueError, RecursionError):
+                    pass
+        # Or followed by some chatter, so take the record at the start if there is one.
+        for attempt in attempts:
+            attempt = attempt.lstrip()
+            if not attempt.startswith("{"):
+                continue
+            try:
+                return cls._json_decoder.raw_decode(attempt)[0]
+            except (ValueError, RecursionError):
+                pass
 
         return None
 
+    _json_decoder = json.JSONDecoder()
+
+    # A JSON string or a None which isn't inside one.
+    json_none_token_regex = re.compile(r'"(?:[^"\\]|\\.)*"|\bNone\b', re.DOTALL)
+
+    @staticmethod
+    def _none_to_null(m: re.Match) -> str:
+        return "null" if m.group(0) == "None" else m.group(0)
+
+    # A JSON string or a bare key (group 1 is the { or , before it, group 2 the key).
+    json_key_token_regex = re.compile(
+        r'"(?:[^"\\]|\\.)*"|([{,])\s*([a-zA-Z_]\w*)\s*:', re.DOTALL
+    )
+
+    @classmethod
+    def _json_repair_scan(cls, json_string: str) -> str:
+        """Quote bare JSON keys in one pass, skipping over strings rather than into them."""
+        return cls.json_key_token_regex.sub(cls._quote_json_key, json_string)
+
+    @staticmethod
+    def _quote_json_key(m: re.Match) -> str:
+        if m.group(1) is None:
+            return m.group(0)
+        return f'{m.group(1)}"{m.group(2)}":'
+
+    # orjson turns integers past 64 bits into floats, so leave anything which might
+    # have one (like a long claim number) to json.
+    json_long_number_regex = re.compile(r"\d{19}")
+
+    @classmethod
+    def _json_loads(cls, data: str):
+        """json.loads, but with orjson first for speed if it is installed."""
+        if orjson is not None and not cls.json_long_number_regex.search(data):
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                # orjson is stricter (no NaN for one) so json still gets a go.
+                pass
+        return json.loads(data)
+
+    @classmethod
+    def clean_pipeline(
+        cls, lt: str, result: Optional[str], input_urls: Optional[List[str]] = None
+    ) -> Union[str, dict, list, int, float, bool, None]:
+        """
+        Run the usual cleanups over an LLM result for lt: drop the trailing notes, fix
+        the TLAs, apply cleanup_lt and then drop invalid URLs. json results are only
+        parsed, giving back whatever JSON value cleanup_json finds.
+        """
+        if result is None:
+            return None
+        # json results get parsed rather than cleaned as text.
+        if lt == "json":
+            return cls.cleanup_lt(lt, result)
+        # Each step skips itself when its marker isn't there. The tails go first so
+        # the later passes have less text to walk, and the URL checks go last since
+        # they hit the network and cleanup_lt can reject the result outright.
+        result = cls.note_remover(result)
+        result = cls.tla_fixer(result)
+        result = cls.cleanup_lt(lt, result)
+        return cls.url_fixer(result, input_urls)
+
     @classmethod
     def cleanup_lt(cls, lt: str, data: Optional[str]) -> Optional[str]:
         if "appeal" in lt and "reasoning" not in lt:
@@ -309,33 +738,222 @@ class CleanerUtils(object):
         # json handled seperately
         if lt == "json":
             return cls.cleanup_json(data)
-        # Use the gernal swap and then add any return type specific swaps
-        my_swaps: dict[str, str] = dict(cls.swaps["general"])
-        if lt in cls.swaps:
-            my_swaps.update(cls.swaps[lt])
-
-        # Since a swap may result in another swap keep swapping until we stop changing.
-        old_data = ""
-        while old_data != data:
-            old_data = data
-            for o, r in my_swaps.items():
-                data = re.sub(o, r, data, flags=re.IGNORECASE)
+        cls._sync_swaps(lt)
+        # Retries and evaluation runs clean the same text over and over, but don't
+        # hold on to huge responses.
+        if len(data) < cls.cleanup_lt_cache_max_length:
+            return cls._cleanup_lt_impl(lt, data)
+        return cls._apply_swaps(lt, data)
+
+    # Longest response cleanup_lt will remember the result for.
+    cleanup_lt_cache_max_length = 16_000
+
+    @classmethod
+    @functools.lru_cache(maxsize=4096)
+    def _cleanup_lt_impl(cls, lt: str, data: str) -> str:
+        return cls._apply_swaps(lt, data)
+
+    @classmethod
+    def _apply_swaps(cls, lt: str, data: str) -> str:
+        if lt not in cls._compiled_swaps:
+            lt = "general"
+        if lt not in cls._swap_runners:
+            cls._swap_runners[lt] = cls._build_swap_runner(lt)
+        return cls._swap_runners[lt](data)
+
+    @classmethod
+    def _build_swap_runner(cls, lt: str) -> Callable[[str], str]:
+        """
+        Generate a function which applies the swaps for lt, with the loop over the
+        swaps unrolled and every pattern, replacement and needle bound as a local.
+
+        Since a swap may result in another swap keep swapping until we stop changing.
+        Rather than re-running every swap after a change, go around the list until a
+        full lap of swaps in a row leaves the text alone. Swaps after the last change in
+        a round already saw the final text, so there is no need to try them again.
+
+        The swaps aren't fused into one alternation: that gives different text when
+        swaps overlap, and re tries every alternative at every position which is far
+        slower than running the few swaps whose needles are present.
+        """
+        namespace: dict[str, Any] = {
+            "fold": cls._fold,
+            "present_needles": cls._present_needles,
+            "replace_literal": cls._replace_literal,
+            "automaton": cls._swap_automatons.get(lt),
+        }
+        body: list[str] = []
+        for k, swap in enumerate(cls._swaps_for(lt)):
+            namespace[f"sub{k}"] = swap.pattern.sub
+            namespace[f"repl{k}"] = swap.replacement
+            refold = "folded = fold(data)"
+            if swap.plain is not None:
+                namespace[f"plain{k}"] = swap.plain
+                step = f"new_data = data.replace(plain{k}, repl{k})"
+            elif (
+                swap.is_literal
+                and swap.replacement.isascii()
+                and "\\" not in swap.replacement
+            ):
+                # Folding ASCII keeps offsets so literals can be found in the folded
+                # copy and spliced into data, skipping the regex entirely.
+                step = (
+                    "new_data, new_folded = "
+                    f"replace_literal(data, folded, needle{k}, repl{k}) "
+                    f"if ascii else (sub{k}(repl{k}, data), None)"
+                )
+                refold = "folded = fold(data) if new_folded is None else new_folded"
+            elif swap.fast_pattern is not None:
+                namespace[f"fast{k}"] = swap.fast_pattern.sub
+                step = f"new_data = (fast{k} if ascii else sub{k})(repl{k}, data)"
+            else:
+                step = f"new_data = sub{k}(repl{k}, data)"
+            lines = [
+                step,
+                "if new_data is not data and new_data != data:",
+                "    data = new_data",
+                f"    {refold}",
+                "    present = present_needles(folded, automaton)",
+                "    ascii = data.isascii()",
+                f"    last = {k}",
+                f"elif last == {k}:",
+                "    return data",
+            ]
+            if swap.needle is not None:
+                # Most swaps are literals which don't show up, skip the regex for those.
+                namespace[f"needle{k}"] = swap.needle
+                lines = [f"if needle{k} in present:"] + [
+                    f"    {line}" for line in lines
+                ]
+                lines += [f"elif last == {k}:", "    return data"]
+            body += lines
+        params = "".join(f", {name}={name}" for name in namespace)
+        source = "\n".join(
+            [
+                f"def _run_swaps(data{params}):",
+                "    folded = fold(data)",
+                "    present = present_needles(folded, automaton)",
+                "    ascii = data.isascii()",
+                "    # Index of the last swap to change data, -1 until one does.",
+                "    last = -1",
+                "    while True:",
+            ]
+            + [f"        {line}" for line in body]
+            + ["        if last == -1:", "            return data", ""]
+        )
+        exec(compile(source, f"<swaps:{lt}>", "exec"), namespace)
+        return namespace["_run_swaps"]
+
+    @classmethod
+    def _swaps_for(cls, lt: str) -> Tuple[_Swap, ...]:
+        # Types without their own swaps share the general list
+        if lt not in cls._compiled_swaps:
+            lt = "general"
+        if lt not in cls._merged_swaps:
+            # Use the gernal swap and then add any return type specific swaps
+            my_swaps = cls._compiled_swaps["general"]
+            if lt != "general":
+                my_swaps = my_swaps + cls._compiled_swaps[lt]
+            cls._merged_swaps[lt] = my_swaps
+        return cls._merged_swaps[lt]
 
+    @classmethod
+    def cleanup_lt_batch(cls, lt: str, data):
+        """
+        Clean up many responses of the same type, giving the same results as cleanup_lt.
+        A pyarrow string array is cleaned with Arrow's vectorized string kernels and
+        an array is returned, any other iterable gives back a list.
+        """
+        # pyarrow is slow to import so it isn't loaded up front. Only something which
+        # has already imported it can hand us an arrow array, so look for it there.
+        pa = sys.modules.get("pyarrow")
+        if pa is None or not isinstance(data, (pa.Array, pa.ChunkedArray)):
+            return [cls.cleanup_lt(lt, d) for d in data]
+        import pyarrow.compute as pc
+
+        if lt == "json":
+            raise ValueError("json responses can't be cleaned into an arrow array")
+        if isinstance(data, pa.ChunkedArray):
+            data = data.combine_chunks()
+
+        if "appeal" in lt and "reasoning" not in lt:
+            rejected = pc.match_substring(data, "45 CFR §146.136")
+            for topic in ["mental health", "psychiatry", "psychology", "counseling"]:
+                rejected = pc.and_(rejected, pc.invert(pc.match_substring(data, topic)))
+            data = pc.if_else(rejected, pa.scalar(None, data.type), data)
+
+        # Arrow's regexes are RE2 so only ASCII text is sure to match the same as re.
+        is_ascii = pc.fill_null(pc.string_is_ascii(data), True)
+        result = data
+        if pc.any(is_ascii).as_py():
+            cleaned = cls._cleanup_lt_arrow(lt, data.filter(is_ascii))
+            result = pc.replace_with_mask(result, is_ascii, cleaned)
+        if not pc.all(is_ascii).as_py():
+            not_ascii = pc.invert(is_ascii)
+            cleaned = [
+                cls.cleanup_lt(lt, d) for d in data.filter(not_ascii).to_pylist()
+            ]
+            result = pc.replace_with_mask(
+                result, not_ascii, pa.array(cleaned, data.type)
+            )
+        return result
+
+    @classmethod
+    def _cleanup_lt_arrow(cls, lt: str, data):
+        # Same fixed point as cleanup_lt, except each swap runs over the whole array.
+        cls._sync_swaps(lt)
+        my_swaps = cls._swaps_for(lt)
+        # Translate the patterns once up front rather than on every lap.
+        arrow_patterns = tuple(cls._arrow_pattern(swap) for swap in my_swaps)
+        old_data = None
+        while old_data is None or not old_data.equals(data):
+            old_data = data
+            for swap, arrow_pattern in zip(my_swaps, arrow_patterns):
+                data = cls._swap_arrow(swap, arrow_pattern, data)
         return data
 
+    @classmethod
+    def _arrow_pattern(cls, swap: _Swap) -> Optional[str]:
+        """The pattern to give Arrow's regex kernel for swap, if it can take it."""
+        if swap.plain is not None or "\\" in swap.replacement:
+            return None
+        translated = cls._re2_pattern(swap.pattern.pattern)
+        if translated is None:
+            return None
+        return "(?i)" + translated
+
+    @classmethod
+    def _swap_arrow(cls, swap: _Swap, arrow_pattern: Optional[str], data):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        if swap.plain is not None:
+            return pc.replace_substring(
+                data, pattern=swap.plain, replacement=swap.replacement
+            )
+        if arrow_pattern is not None:
+            try:
+                return pc.replace_substring_regex(
+                    data, pattern=arrow_pattern, replacement=swap.replacement
+                )
+            except pa.ArrowInvalid:
+                pass
+        return pa.array(
+            [
+                None if d is None else swap.pattern.sub(swap.replacement, d)
+                for d in data.to_pylist()
+            ],
+            data.type,
+        )
+
     # Find all JSON keys without quotes (no spaces allowed in keys)
     json_pattern_keys = re.compile(r"([{,])\s*([a-zA-Z_]\w*)\s*:")
-    # Find all JSON values without quotes (including null) and spaces allowed in values
-    json_pattern_values = re.compile(
-        r'(?<=[{,])\s*([a-zA-Z_]\w*)\s*:\s*([^,"}\]]+|null)'
-    )
 
     @classmethod
     def fix_missing_quotes(cls, json_string: str) -> str:
-        fixed_json = cls.json_pattern_keys.sub(r' \1"\2":', json_string)
-        fixed_json = cls.json_pattern_values.sub(r' "\1": \2', fixed_json)
-
-        return fixed_json
+        # A single pass over the keys is enough: a bare key with an unquoted value
+        # after it is still a json_pattern_keys match, and the value is left as is.
+        return cls.json_pattern_keys.sub(r' \1"\2":', json_string)
 
     json_missing_colon_pattern = re.compile(r'([{,])\s*([a-zA-Z_]\w*)\s+([^",}\]]+)')
 
@@ -345,7 +963,11 @@ class CleanerUtils(object):
         fixed_json = cls.json_missing_colon_pattern.sub(r' \1"\2": \3', json_string)
         return fixed_json
 
-    maybe_bad_url_endings = re.compile(r"^(.*)[\.\:\;\,\?\>\)\]]+$")
+    # Punctuation the URL regex picks up from the surrounding sentence.
+    url_trailing_punctuation = ".:;,?>)]"
+
+    # How much of a page is_valid_url reads looking for common_bad_result_regex.
+    url_check_max_bytes = 65536
 
     # Some people return 200 when they should return 404
     common_bad_result_regex = re.compile(
@@ -357,6 +979,9 @@ class CleanerUtils(object):
     url_pattern = "https?:\\/\\/(?:www\\.)?[-a-zA-Z0-9@:%._\\+~#=]{1,256}\\.[a-zA-Z0-9()]{1,6}\\b(?:[-a-zA-Z0-9@:%_\\+.~#?&\\/=]*)"
     url_re = re.compile(url_pattern, re.IGNORECASE)
 
+    # How many URLs url_fixer and is_valid_url_batch check at once.
+    url_check_concurrency = 64
+
     @classmethod
     def url_fixer(
         cls, result: Optional[str], input_urls: Optional[List[str]] = None
@@ -365,44 +990,132 @@ class CleanerUtils(object):
         if result is None:
             return None
 
+        # Every url_re match has a "://", so skip the scan when there can't be one.
+        if "://" not in result:
+            return result
         input_urls = input_urls or []
         urls = cls.url_re.findall(result)
+        # Skip validation for URLs that were in the input
+        to_check = list(dict.fromkeys(u for u in urls if u not in input_urls))
+        valid: dict[str, bool] = {}
+        if to_check:
+            # The checks are all waiting on the network so run them side by side.
+            workers = min(cls.url_check_concurrency, len(to_check))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                valid = dict(zip(to_check, executor.map(cls.is_valid_url, to_check)))
         for u in urls:
-            print(f"{u}")
-            # Skip validation for URLs that were in the input
+            logger.debug("Found url %s", u)
             if u in input_urls:
                 continue
-            if not cls.is_valid_url(u):
-                print(f"Removing invalid url {u}")
+            if not valid[u]:
+                logger.info("Removing invalid url %s", u)
                 result = result.replace(u, "")
         return result
 
+    @classmethod
+    async def is_valid_url_batch(cls, urls: List[str]) -> List[bool]:
+        """Check many URLs at once, returning is_valid_url for each of them in order."""
+        unique = list(dict.fromkeys(urls))
+        if not unique:
+            return []
+        # Only the batch check needs asyncio, and it is slow to import.
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        workers = min(cls.url_check_concurrency, len(unique))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            checks = [
+                loop.run_in_executor(executor, cls.is_valid_url, u) for u in unique
+            ]
+            valid = dict(zip(unique, await asyncio.gather(*checks)))
+        return [valid[u] for u in urls]
+
+    # How long, in seconds, is_valid_url remembers the result for a URL.
+    url_check_cache_ttl = 3600
+
     @classmethod
     def is_valid_url(cls, url):
+        # LLMs repeat the same URLs across responses, so remember the answers for a
+        # while. Keying on the time bucket expires everything when it rolls over.
+        bucket = int(time.monotonic() // cls.url_check_cache_ttl)
+        return cls._cached_is_valid_url(url, bucket)
+
+    @classmethod
+    @functools.lru_cache(maxsize=4096)
+    def _cached_is_valid_url(cls, url, bucket):
+        return cls._check_url(url)
+
+    # Hosts which didn't resolve, and when we found that out. LLMs tend to make up the
+    # same hosts over and over so this saves a lookup for every new path on them.
+    _bad_hosts: dict = {}
+
+    @classmethod
+    def _is_bad_host(cls, host: Optional[str]) -> bool:
+        added = cls._bad_hosts.get(host) if host else None
+        if added is None:
+            return False
+        # DNS failures can be transient so they expire like the URL cache does.
+        if time.monotonic() - added > cls.url_check_cache_ttl:
+            cls._bad_hosts.pop(host, None)
+            return False
+        return True
+
+    @classmethod
+    def _check_url(cls, url):
+        host = None
         try:
+            host = urllib_parse.urlparse(url).hostname
+            if cls._is_bad_host(host):
+                raise urllib_error.URLError(f"{host} did not resolve")
             # Some folks don't like the default urllib UA.
             headers = {
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.45 Safari/537.36"
             }
+            if "pdf" in url:
+                # We don't look at the body of PDFs so a HEAD is enough when it works.
+                try:
+                    head = urllib_request.Request(url, headers=headers, method="HEAD")
+                    with urllib_request.urlopen(head):
+                        return True
+                except Exception:
+                    # Plenty of servers don't handle HEAD, fall back to a GET.
+                    pass
             request = urllib_request.Request(url, headers=headers)
-            result = urllib_request.urlopen(request)
-            if "pdf" not in url:
+            # Close the connection as soon as we're done rather than when it's collected.
+            with urllib_request.urlopen(request) as result:
+                if "pdf" in url:
+                    return True
                 try:
-                    result_text = result.read().decode("utf-8").lower()
+                    # The error pages are short so don't pull in all of a large page. The
+                    # incremental decoder doesn't mind a character cut off at the end.
+                    result_text = codecs.getincrementaldecoder("utf-8")().decode(
+                        result.read(cls.url_check_max_bytes)
+                    )
                 except Exception as e:
                     # Handle cases where the content cannot be decoded as utf-8
-                    print(
-                        f"Failed to decode content from {url}: {e} but it could be a PDF so we'll assume its valid"
+                    logger.info(
+                        "Failed to decode content from %s: %s but it could be a PDF so we'll assume its valid",
+                        url,
+                        e,
                     )
                     return True
-                if cls.common_bad_result_regex.match(result_text):
-                    print("Got a 200 but it sounds like we cant find it")
-                    return False
+            if cls.common_bad_result_regex.search(result_text):
+                logger.info("Got a 200 from %s but it sounds like we cant find it", url)
+                return False
             return True
         except Exception as e:
-            groups = cls.maybe_bad_url_endings.search(url)
-            if groups is not None:
-                return cls.is_valid_url(groups.group(1))
+            if (
+                isinstance(e, urllib_error.URLError)
+                and isinstance(e.reason, socket.gaierror)
+                and host
+            ):
+                cls._bad_hosts[host] = time.monotonic()
+            # Strip one character at a time so the longest valid URL wins.
+            if url and url[-1] in cls.url_trailing_punctuation:
+                return cls.is_valid_url(url[:-1])
             else:
-                print(f"Bad url {url} e {e} with no bad to strip")
+                logger.info("Bad url %s e %s with no bad to strip", url, e)
                 return False
+
+
+CleanerUtils._init_swaps()
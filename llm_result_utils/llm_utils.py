@@ -1,34 +1,39 @@
 from typing import Optional, Union
+import logging
 import re
 import chardet
 
+from llm_result_utils.text_utils import TextUtils
 
-class LLMResponseUtils(object):
-    tla_regex = re.compile("([A-Z])\\w+ ([A-Z])\\w+ ([A-Z])\\w+ \\(([A-Z]{3})\\)")
-    note_regex = re.compile(r"\n\s*\**\s*Note.*\Z")
+logger = logging.getLogger(__name__)
 
-    @classmethod
-    def tla_fixer(cls, result: Optional[str]) -> Optional[str]:
-        """Fix incorrectly picked TLAs from the LLM."""
-        if result is None:
-            return None
-        else:
-            # Look for three letter acronyms
-            matches = cls.tla_regex.finditer(result)
-            for m in matches:
-                tla = m.group(1) + m.group(2) + m.group(3)
-                if tla != m.group(4):
-                    return re.sub(f"(?<=[\\.\\( ]){m.group(4)}", tla, result)
-            return result
+
+class LLMResponseUtils(TextUtils):
+    # tla_regex, note_regex and tla_fixer come from TextUtils, shared with CleanerUtils.
+    # Top-level thinking/think sections, allowing for nested tags
+    _thinking_pattern = re.compile(
+        r"<thinking>(?:[^<]|<(?!/?thinking>)|(?:<thinking>.*?</thinking>))*</thinking>",
+        re.DOTALL,
+    )
+    _think_pattern = re.compile(
+        r"<think>(?:[^<]|<(?!/?think>)|(?:<think>.*?</think>))*</think>", re.DOTALL
+    )
+    _answer_tags_regex = re.compile(r"<answer>|</answer>")
+    _reasoning_tags_regex = re.compile(r"<think>|</think>|</thinking>|<thinking>")
 
     @classmethod
     def note_remover(cls, result: Optional[str]) -> Optional[str]:
         """Remove the last line note because we'll put similar content up earlier anyways"""
         if result is None:
             return None
+        elif "Note" not in result:
+            return result
         else:
             return cls.note_regex.sub("", result)
 
+    # Most bytes of non UTF-8 input is_valid_text hands to chardet.
+    encoding_sniff_bytes = 4096
+
     @classmethod
     def is_valid_text(cls, data: Union[str, bytes, None]) -> bool:
         """
@@ -46,13 +51,22 @@ class LLMResponseUtils(object):
 
         # If it's bytes, try to decode it as UTF-8
         if isinstance(data, bytes):
+            # ASCII is valid UTF-8 and checking for it doesn't build a string.
+            if not data or data.isascii():
+                return True
             try:
                 # Try to decode as UTF-8
-                data.decode("utf-8")
+                str(data, "utf-8")
                 return True
-            except UnicodeDecodeError:
+            except UnicodeDecodeError as e:
+                # chardet is slow on big inputs, so only sniff from where UTF-8 went
+                # wrong (earlier bytes decoded fine so say little about the encoding)
+                # and then let decoding all of it confirm the guess.
+                sample = data
+                if len(data) > cls.encoding_sniff_bytes:
+                    sample = data[e.start : e.start + cls.encoding_sniff_bytes]
                 # Try to detect encoding and decode
-                detection = chardet.detect(data)
+                detection = chardet.detect(sample)
                 if detection["confidence"] > 0.7:  # Reasonable confidence threshold
                     try:
                         if "encoding" in detection and detection["encoding"]:
@@ -76,19 +90,9 @@ class LLMResponseUtils(object):
         """
         if result is None:
             return False
-        # Use regex to handle nested thinking tags properly
-        # First try to find all top-level thinking/think tags
-        thinking_pattern = re.compile(
-            r"<thinking>(?:[^<]|<(?!/?thinking>)|(?:<thinking>.*?</thinking>))*</thinking>",
-            re.DOTALL,
-        )
-        think_pattern = re.compile(
-            r"<think>(?:[^<]|<(?!/?think>)|(?:<think>.*?</think>))*</think>", re.DOTALL
-        )
-
-        # Find all matches
-        thinking_matches = thinking_pattern.findall(result)
-        think_matches = think_pattern.findall(result)
+        # Without any tags there is nothing to check
+        if "<think" not in result:
+            return False
 
         # Count opening and closing tags - they should be balanced
         num_thinking_open = result.count("<thinking>")
@@ -102,17 +106,20 @@ class LLMResponseUtils(object):
         ):
             return False
 
+        # Use regex to handle nested thinking tags properly, only the first
+        # top-level thinking/think section matters.
+        thinking_match = cls._thinking_pattern.search(result)
+        think_match = cls._think_pattern.search(result)
+
         # Ensure there's text after the last closing tag of the top-level thinking section
         last_thinking_close = -1
         last_think_close = -1
 
-        if thinking_matches:
-            last_thinking_close = result.find(thinking_matches[0]) + len(
-                thinking_matches[0]
-            )
+        if thinking_match:
+            last_thinking_close = thinking_match.end()
 
-        if think_matches:
-            last_think_close = result.find(think_matches[0]) + len(think_matches[0])
+        if think_match:
+            last_think_close = think_match.end()
 
         last_closing_tag = max(last_thinking_close, last_think_close)
 
@@ -145,53 +152,33 @@ class LLMResponseUtils(object):
         if not result:
             return (None, None)
 
-        # Use regex to handle nested thinking tags properly
-        # First try to find all top-level thinking/think tags
-        thinking_pattern = re.compile(
-            r"(?:[^<]|<(?!/?thinking>)|(?:<thinking>.*?</thinking>))*.*</thinking>",
-            re.DOTALL,
-        )
-        think_pattern = re.compile(
-            r"(?:[^<]|<(?!/?think>)|(?:<think>.*?</think>))*.*</think>",
-            re.DOTALL,
-        )
-
-        # Find all matches
-        thinking_matches = thinking_pattern.findall(result)
-        think_matches = think_pattern.findall(result)
+        # Everything up to the last closing tag is reasoning, however the tags nest.
+        # A regex over the nested tags blew up on long responses with unclosed tags.
+        all_positions = [
+            result.rfind(tag) + len(tag)
+            for tag in ("</thinking>", "</think>")
+            if tag in result
+        ]
 
         reasoning: Optional[str] = None
         answer: Optional[str] = None
 
         # If no thinking tags were found, return the original text
-        if not thinking_matches and not think_matches:
-            print(f"No thinking match returning raw answer")
+        if not all_positions:
+            logger.debug("No thinking match returning raw answer")
             answer = result
         else:
-            # Get the positions of all closing tags
-            thinking_end_positions = [
-                m.end() for m in thinking_pattern.finditer(result)
-            ]
-            think_end_positions = [m.end() for m in think_pattern.finditer(result)]
-
-            # Find the last closing tag position
-            all_positions = thinking_end_positions + think_end_positions
-            if not all_positions:
-                answer = result
-            else:
-                last_position = max(all_positions)
-                # Extract everything after the last closing tag
-                answer = result[last_position:].strip()
-                reasoning = result[:last_position].strip()
+            last_position = max(all_positions)
+            # Extract everything after the last closing tag
+            answer = result[last_position:].strip()
+            reasoning = result[:last_position].strip()
 
         # Remove any answer tags if present
         if answer:
-            answer = re.sub(r"<answer>|</answer>", "", answer)
+            answer = cls._answer_tags_regex.sub("", answer)
             answer = answer.strip()
         if reasoning:
-            reasoning = re.sub(
-                r"<think>|</think>|</thinking>|<thinking>", "", reasoning
-            )
+            reasoning = cls._reasoning_tags_regex.sub("", reasoning)
             reasoning = reasoning.strip()
 
         return reasoning, answer
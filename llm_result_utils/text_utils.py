@@ -0,0 +1,46 @@
+from typing import Optional
+import re
+
+
+class TextUtils(object):
+    """
+    Patterns and fixes shared by CleanerUtils and LLMResponseUtils. Kept apart so
+    llm_utils doesn't have to load (and compile the swaps in) cleaner_utils.
+    """
+
+    tla_regex = re.compile("([A-Z])\\w+ ([A-Z])\\w+ ([A-Z])\\w+ \\(([A-Z]{3})\\)")
+    # The end of a tla_regex match, much cheaper to look for than the whole thing.
+    tla_suffix_regex = re.compile(r" \([A-Z]{3}\)")
+    # Anywhere a TLA could be swapped by tla_fixer.
+    tla_candidate_regex = re.compile(r"(?<=[\.\( ])[A-Z]{3}")
+    note_regex = re.compile(r"\n\s*\**\s*Note.*\Z")
+
+    @classmethod
+    def tla_fixer(cls, result: Optional[str]) -> Optional[str]:
+        """Fix incorrectly identified TLAs (Three Letter Acronyms) in text."""
+        if result is None:
+            return None
+        # tla_regex can take quadratic time over long runs of word characters, so
+        # don't run it unless there is a (TLA) for it to find.
+        if "(" not in result or not cls.tla_suffix_regex.search(result):
+            return result
+
+        # Look for three letter acronyms
+        fixes: dict[str, str] = {}
+        matches = cls.tla_regex.finditer(result)
+        for m in matches:
+            tla = m.group(1) + m.group(2) + m.group(3)
+            bad = m.group(4)
+            if tla != bad:
+                # Each fix applies on top of the earlier ones, so anything already
+                # being turned into the bad TLA becomes the good one instead.
+                for original, fixed in fixes.items():
+                    if fixed == bad:
+                        fixes[original] = tla
+                fixes.setdefault(bad, tla)
+        if not fixes:
+            return result
+        # Swap the bad TLAs in one pass.
+        return cls.tla_candidate_regex.sub(
+            lambda m: fixes.get(m.group(0), m.group(0)), result
+        )
@@ -1,9 +1,18 @@
+import asyncio
+import io
+import socket
 from unittest import TestCase
+from unittest.mock import patch
+from urllib import error as urllib_error
 from llm_result_utils.cleaner_utils import CleanerUtils
 
 
 class TestBadURLs(TestCase):
 
+    def setUp(self):
+        CleanerUtils._cached_is_valid_url.cache_clear()
+        CleanerUtils._bad_hosts.clear()
+
     def test_none(self):
         fixed = CleanerUtils.url_fixer(None)
         self.assertEqual(None, fixed)
@@ -14,3 +23,79 @@ class TestBadURLs(TestCase):
             "http://www.google.com http://www.google.com/farts"
         )
         self.assertEqual("http://www.google.com ", fixed)
+
+    def test_batch(self):
+        with patch.object(
+            CleanerUtils, "is_valid_url", side_effect=lambda u: "farts" not in u
+        ) as is_valid_url:
+            valid = asyncio.run(
+                CleanerUtils.is_valid_url_batch(
+                    [
+                        "http://www.google.com",
+                        "http://www.google.com/farts",
+                        "http://www.google.com",
+                    ]
+                )
+            )
+        self.assertEqual([True, False, True], valid)
+        self.assertEqual(2, is_valid_url.call_count)
+
+    def test_soft_404(self):
+        page = b"<html><body>The requested article is not currently available on this site.</body></html>"
+        with patch(
+            "llm_result_utils.cleaner_utils.urllib_request.urlopen",
+            return_value=io.BytesIO(page),
+        ):
+            self.assertFalse(CleanerUtils.is_valid_url("https://example.com/farts"))
+        with patch(
+            "llm_result_utils.cleaner_utils.urllib_request.urlopen",
+            return_value=io.BytesIO(b"<html>Farts are magic</html>"),
+        ):
+            self.assertTrue(CleanerUtils.is_valid_url("https://example.com/magic"))
+
+    def test_trailing_punctuation(self):
+        def urlopen(request):
+            if request.full_url[-1] in ").":
+                raise ValueError("Bad url")
+            return io.BytesIO(b"<html>Farts are magic</html>")
+
+        with patch(
+            "llm_result_utils.cleaner_utils.urllib_request.urlopen",
+            side_effect=urlopen,
+        ) as mock_urlopen:
+            self.assertTrue(CleanerUtils.is_valid_url("https://example.com/magic)."))
+        self.assertEqual(3, mock_urlopen.call_count)
+
+    def test_cached(self):
+        with patch(
+            "llm_result_utils.cleaner_utils.urllib_request.urlopen",
+            return_value=io.BytesIO(b"<html>Farts are magic</html>"),
+        ) as mock_urlopen:
+            self.assertTrue(CleanerUtils.is_valid_url("https://example.com/magic"))
+            self.assertTrue(CleanerUtils.is_valid_url("https://example.com/magic"))
+        self.assertEqual(1, mock_urlopen.call_count)
+
+    def test_fixer_checks_each_url_once(self):
+        with patch.object(
+            CleanerUtils, "is_valid_url", side_effect=lambda u: "farts" not in u
+        ) as is_valid_url:
+            fixed = CleanerUtils.url_fixer(
+                "See https://example.com/farts and https://example.com/magic "
+                "or https://example.com/farts again, https://example.com/input/farts",
+                input_urls=["https://example.com/input/farts"],
+            )
+        self.assertEqual(
+            "See  and https://example.com/magic or  again, "
+            "https://example.com/input/farts",
+            fixed,
+        )
+        self.assertEqual(2, is_valid_url.call_count)
+
+    def test_bad_host_remembered(self):
+        with patch(
+            "llm_result_utils.cleaner_utils.urllib_request.urlopen",
+            side_effect=urllib_error.URLError(socket.gaierror(-2, "Name unknown")),
+        ) as mock_urlopen:
+            self.assertFalse(CleanerUtils.is_valid_url("https://farts.fake/a"))
+            self.assertFalse(CleanerUtils.is_valid_url("https://farts.fake/b"))
+        self.assertEqual(1, mock_urlopen.call_count)
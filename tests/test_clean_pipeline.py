@@ -0,0 +1,38 @@
+from unittest import TestCase
+from unittest.mock import patch
+from llm_result_utils.cleaner_utils import CleanerUtils
+
+
+class TestCleanPipeline(TestCase):
+
+    def test_none(self):
+        self.assertEqual(None, CleanerUtils.clean_pipeline("appeal", None))
+
+    def test_pipeline(self):
+        with patch.object(
+            CleanerUtils, "is_valid_url", side_effect=lambda u: "farts" not in u
+        ):
+            fixed = CleanerUtils.clean_pipeline(
+                "diagnosis",
+                "The diagnosis is Facial Feminization Surgery (FFF) "
+                "see https://example.com/farts\n**Note: farts are magic",
+            )
+        self.assertEqual("Facial Feminization Surgery (FFS) see ", fixed)
+
+    def test_no_urls(self):
+        with patch.object(CleanerUtils, "is_valid_url") as is_valid_url:
+            fixed = CleanerUtils.clean_pipeline("general", "Farts are magic")
+        self.assertEqual("Farts are magic", fixed)
+        is_valid_url.assert_not_called()
+
+    def test_rejected(self):
+        with patch.object(CleanerUtils, "is_valid_url") as is_valid_url:
+            fixed = CleanerUtils.clean_pipeline(
+                "appeal", "Per 45 CFR §146.136 see https://example.com/farts"
+            )
+        self.assertEqual(None, fixed)
+        is_valid_url.assert_not_called()
+
+    def test_json(self):
+        fixed = CleanerUtils.clean_pipeline("json", '{"farts": "magic",')
+        self.assertEqual({"farts": "magic"}, fixed)
@@ -0,0 +1,46 @@
+from unittest import TestCase
+from llm_result_utils.cleaner_utils import CleanerUtils
+
+
+class TestCleanupJSON(TestCase):
+
+    def test_valid(self):
+        fixed = CleanerUtils.cleanup_json('{"farts": "magic", "count": 3}')
+        self.assertEqual({"farts": "magic", "count": 3}, fixed)
+
+    def test_trailing_comma(self):
+        fixed = CleanerUtils.cleanup_json('{"farts": "magic", "count": 3,')
+        self.assertEqual({"farts": "magic", "count": 3}, fixed)
+
+    def test_cut_off(self):
+        fixed = CleanerUtils.cleanup_json('{"farts": "magic')
+        self.assertEqual({"farts": "magic"}, fixed)
+
+    def test_garbage(self):
+        self.assertEqual(None, CleanerUtils.cleanup_json("farts"))
+
+    def test_missing_quotes(self):
+        fixed = CleanerUtils.cleanup_json('{farts: "magic", count: 3}')
+        self.assertEqual({"farts": "magic", "count": 3}, fixed)
+
+    def test_missing_quotes_leaves_strings_alone(self):
+        fixed = CleanerUtils.cleanup_json('{farts: "magic, count: 3"}')
+        self.assertEqual({"farts": "magic, count: 3"}, fixed)
+
+    def test_trailing_chatter(self):
+        fixed = CleanerUtils.cleanup_json('{"farts": "magic"}\nHope that helps!')
+        self.assertEqual({"farts": "magic"}, fixed)
+
+    def test_none(self):
+        fixed = CleanerUtils.cleanup_json('{"farts": None, "magic": "None of it"}')
+        self.assertEqual({"farts": None, "magic": "None of it"}, fixed)
+
+    def test_big_ints(self):
+        fixed = CleanerUtils.cleanup_json(
+            '{"count": %d, "claim_id": 123456789012345678901234}' % 2**64
+        )
+        self.assertEqual({"count": 2**64, "claim_id": 123456789012345678901234}, fixed)
+
+    def test_deeply_nested(self):
+        self.assertEqual(None, CleanerUtils.cleanup_json("[" * 5000))
+        self.assertEqual(None, CleanerUtils.cleanup_json('{"a":' * 3000))
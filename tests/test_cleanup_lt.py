@@ -0,0 +1,161 @@
+import subprocess
+import sys
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+from llm_result_utils.cleaner_utils import CleanerUtils
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+class TestCleanupLT(TestCase):
+
+    def test_none(self):
+        self.assertEqual(None, CleanerUtils.cleanup_lt("denial", None))
+
+    def test_general(self):
+        fixed = CleanerUtils.cleanup_lt(
+            "general", "BASED ON THE INFORMATION PROVIDED, farts are magic."
+        )
+        self.assertEqual("farts are magic.", fixed)
+
+    def test_type_specific(self):
+        fixed = CleanerUtils.cleanup_lt(
+            "diagnosis", "The diagnosis is gender dysphoria"
+        )
+        self.assertEqual("gender dysphoria", fixed)
+        # Other types don't get the diagnosis swaps
+        fixed = CleanerUtils.cleanup_lt(
+            "treatment", "The diagnosis is gender dysphoria"
+        )
+        self.assertEqual("The diagnosis is gender dysphoria", fixed)
+
+    def test_regex_swap(self):
+        fixed = CleanerUtils.cleanup_lt(
+            "denial", "The requested MRI is appropriate for this patient."
+        )
+        self.assertEqual("the request has been denied for this patient.", fixed)
+
+    def test_literal_swap_ignores_case(self):
+        fixed = CleanerUtils.cleanup_lt("denial", "THE PHYSICIAN REVIEWER thinks so.")
+        self.assertEqual("we thinks so.", fixed)
+
+    def test_cascading_swaps(self):
+        fixed = CleanerUtils.cleanup_lt("appeal", "Farts....    are magic")
+        self.assertEqual("Farts. are magic", fixed)
+
+    def test_non_ascii_case(self):
+        # IGNORECASE treats the dotless i as an i so the literal swaps must too.
+        fixed = CleanerUtils.cleanup_lt(
+            "diagnosis", "The dıagnosıs ıs gender dysphoria, ßtill"
+        )
+        self.assertEqual("gender dysphoria, ßtill", fixed)
+
+    def test_swap_reveals_earlier_swap(self):
+        # Removing "the enrollees " exposes "The diagnosis is " which comes before it.
+        fixed = CleanerUtils.cleanup_lt(
+            "diagnosis", "The diagnosis the enrollees is gender dysphoria"
+        )
+        self.assertEqual("gender dysphoria", fixed)
+
+    def test_swap_reveals_itself(self):
+        # A swap's own output can match it again, so it has to be retried after it fires.
+        fixed = CleanerUtils.cleanup_lt(
+            "appeal",
+            "According to the According to the independent medical review, "
+            "independent medical review, farts are magic.",
+        )
+        self.assertEqual("farts are magic.", fixed)
+
+    def test_whitespace_matches_python_re(self):
+        # \v and the ASCII separators are \s for re, make sure any engine agrees.
+        fixed = CleanerUtils.cleanup_lt("treatment", "\x0b\x1cThe treatment is surgery")
+        self.assertEqual("surgery", fixed)
+
+    def test_duplicate_swaps_kept(self):
+        # Swaps run in order, so an earlier duplicate must not be replaced by a later one.
+        swaps = {"general": [("farts", "magic"), ("farts", "nope")]}
+        try:
+            with patch.object(CleanerUtils, "swaps", swaps):
+                CleanerUtils._init_swaps()
+                fixed = CleanerUtils.cleanup_lt("general", "farts are farts")
+        finally:
+            CleanerUtils._init_swaps()
+        self.assertEqual("magic are magic", fixed)
+
+    def test_no_needles(self):
+        swaps = {"general": [(r"\d+", "N")]}
+        try:
+            with patch.object(CleanerUtils, "swaps", swaps):
+                CleanerUtils._init_swaps()
+                fixed = CleanerUtils.cleanup_lt("general", "farts 42")
+        finally:
+            CleanerUtils._init_swaps()
+        self.assertEqual("farts N", fixed)
+
+    def test_multi_character_escapes(self):
+        # The text after \x41 or \101 isn't literal so it can't be used as a needle.
+        swaps = {"general": [(r"\x41bc", "Z"), (r"\104ef", "Y")]}
+        try:
+            with patch.object(CleanerUtils, "swaps", swaps):
+                CleanerUtils._init_swaps()
+                fixed = CleanerUtils.cleanup_lt("general", "ABC abc DEF def")
+        finally:
+            CleanerUtils._init_swaps()
+        self.assertEqual("Z Z Y Y", fixed)
+
+    def test_swaps_added_later(self):
+        try:
+            CleanerUtils.swaps["custom"] = (("farts", "magic"),)
+            fixed = CleanerUtils.cleanup_lt("custom", "farts are farts")
+            self.assertEqual("magic are magic", fixed)
+            CleanerUtils.swaps["custom"] = [("farts", "nope")]
+            fixed = CleanerUtils.cleanup_lt("custom", "farts are farts")
+            self.assertEqual("nope are nope", fixed)
+        finally:
+            CleanerUtils.swaps.pop("custom", None)
+            CleanerUtils._init_swaps()
+
+    def test_swaps_key_not_an_identifier(self):
+        try:
+            CleanerUtils.swaps["patient-history type"] = (("farts", "magic"),)
+            fixed = CleanerUtils.cleanup_lt("patient-history type", "farts")
+        finally:
+            CleanerUtils.swaps.pop("patient-history type", None)
+            CleanerUtils._init_swaps()
+        self.assertEqual("magic", fixed)
+
+    def test_cached(self):
+        CleanerUtils._cleanup_lt_impl.cache_clear()
+        for _ in range(2):
+            fixed = CleanerUtils.cleanup_lt("diagnosis", "The diagnosis is FFS")
+            self.assertEqual("FFS", fixed)
+        self.assertEqual(1, CleanerUtils._cleanup_lt_impl.cache_info().hits)
+
+    def test_batch(self):
+        batch = ["The diagnosis is gender dysphoria", None, "The dıagnosıs ıs FFS"]
+        fixed = CleanerUtils.cleanup_lt_batch("diagnosis", batch)
+        self.assertEqual(["gender dysphoria", None, "FFS"], fixed)
+
+    @skipIf(pa is None, "pyarrow is not installed")
+    def test_batch_arrow(self):
+        batch = ["The diagnosis is gender dysphoria", None, "The dıagnosıs ıs FFS"]
+        fixed = CleanerUtils.cleanup_lt_batch("diagnosis", pa.array(batch))
+        self.assertEqual(["gender dysphoria", None, "FFS"], fixed.to_pylist())
+
+    def test_import_is_lazy(self):
+        # A fresh interpreter, as pyarrow may already be loaded in this one.
+        loaded = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, llm_result_utils.cleaner_utils; "
+                "print([m for m in ('pyarrow', 'asyncio') if m in sys.modules])",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        self.assertEqual("[]", loaded)
@@ -0,0 +1,93 @@
+import subprocess
+import sys
+from unittest import TestCase
+from llm_result_utils.llm_utils import LLMResponseUtils
+
+
+class TestReasoning(TestCase):
+
+    def test_well_formatted(self):
+        self.assertTrue(
+            LLMResponseUtils.is_well_formatted_for_reasoning(
+                "<think>Farts <think>are</think> magic</think> Yes they are."
+            )
+        )
+        self.assertTrue(
+            LLMResponseUtils.is_well_formatted_for_reasoning(
+                "<thinking>Farts</thinking> Yes they are."
+            )
+        )
+
+    def test_not_well_formatted(self):
+        self.assertFalse(LLMResponseUtils.is_well_formatted_for_reasoning(None))
+        self.assertFalse(LLMResponseUtils.is_well_formatted_for_reasoning("Farts."))
+        self.assertFalse(
+            LLMResponseUtils.is_well_formatted_for_reasoning("<think>Farts</think>")
+        )
+        self.assertFalse(
+            LLMResponseUtils.is_well_formatted_for_reasoning(
+                "<think>Farts <think>magic</think> Yes they are."
+            )
+        )
+
+    def test_extract_reasoning_and_answer(self):
+        reasoning, answer = LLMResponseUtils.extract_reasoning_and_answer(
+            "<think>Farts <think>are</think> magic</think>\n<answer>Yes</answer>"
+        )
+        self.assertEqual("Farts are magic", reasoning)
+        self.assertEqual("Yes", answer)
+
+    def test_extract_no_reasoning(self):
+        reasoning, answer = LLMResponseUtils.extract_reasoning_and_answer("Yes")
+        self.assertEqual(None, reasoning)
+        self.assertEqual("Yes", answer)
+
+    def test_extract_unclosed(self):
+        text = "<think> farts are magic " * 2000 + "</thinking"
+        reasoning, answer = LLMResponseUtils.extract_reasoning_and_answer(text)
+        self.assertEqual(None, reasoning)
+        self.assertEqual(text, answer)
+
+
+class TestTLA(TestCase):
+
+    def test_none(self):
+        self.assertEqual(None, LLMResponseUtils.tla_fixer(None))
+
+    def test_import_skips_cleaner_utils(self):
+        # The TLA patterns are shared without compiling all of CleanerUtils' swaps.
+        loaded = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, llm_result_utils.llm_utils; "
+                "print('llm_result_utils.cleaner_utils' in sys.modules)",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        self.assertEqual("False", loaded)
+
+    def test_multiple_badtlas(self):
+        fixed = LLMResponseUtils.tla_fixer(
+            "Farts Farts Magic (FFG). Magic Beans Tea (MBB). FFG and MBB."
+        )
+        self.assertEqual(
+            "Farts Farts Magic (FFM). Magic Beans Tea (MBT). FFM and MBT.", fixed
+        )
+
+
+class TestValidText(TestCase):
+
+    def test_valid_text(self):
+        self.assertTrue(LLMResponseUtils.is_valid_text("Farts are magic"))
+        self.assertTrue(LLMResponseUtils.is_valid_text(b""))
+        self.assertTrue(LLMResponseUtils.is_valid_text("Zürich farts".encode("utf-8")))
+        self.assertFalse(LLMResponseUtils.is_valid_text(None))
+
+    def test_large_non_utf8(self):
+        # The sample starts at the bad bytes so the ASCII prefix doesn't hide them.
+        japanese = "これは日本語のテキストです。おならは魔法です。".encode("shift_jis")
+        data = b"Farts are magic. " * 1000 + japanese * 300
+        self.assertTrue(LLMResponseUtils.is_valid_text(data))
@@ -0,0 +1,23 @@
+from unittest import TestCase
+from llm_result_utils.cleaner_utils import CleanerUtils
+
+
+class TestNoteRemover(TestCase):
+
+    def test_none(self):
+        self.assertEqual(None, CleanerUtils.note_remover(None))
+
+    def test_no_tail(self):
+        text = "Farts are magic.\nThey really are."
+        self.assertEqual(text, CleanerUtils.note_remover(text))
+
+    def test_note(self):
+        fixed = CleanerUtils.note_remover("Farts are magic.\n\n**Note:** not really.")
+        self.assertEqual("Farts are magic.", fixed)
+
+    def test_tails(self):
+        fixed = CleanerUtils.note_remover(
+            "Farts are magic.\n### **Why This Works**\nIt is.\n"
+            "**Key Compliance Notes**\nNone.\nNote: ok"
+        )
+        self.assertEqual("Farts are magic.\n", fixed)
@@ -0,0 +1,17 @@
+from unittest import TestCase
+from llm_result_utils.cleaner_utils import CleanerUtils
+
+
+class TestRemoveControlCharacters(TestCase):
+
+    def test_ascii(self):
+        fixed = CleanerUtils.remove_control_characters("Farts\x00 are\t magic.\n")
+        self.assertEqual("Farts are magic.\n", fixed)
+
+    def test_non_ascii(self):
+        fixed = CleanerUtils.remove_control_characters("Farts\u200b — magic\x85\n")
+        self.assertEqual("Farts — magic\n", fixed)
+
+    def test_nothing_to_remove(self):
+        text = "Farts\u00a0are “magic”.\nCafé"
+        self.assertEqual(text, CleanerUtils.remove_control_characters(text))
@@ -11,3 +11,11 @@ class TestTLA(TestCase):
     def test_badtla(self):
         fixed = CleanerUtils.tla_fixer("Farts Farts Magic (FFG). FFG is.")
         self.assertEqual("Farts Farts Magic (FFM). FFM is.", fixed)
+
+    def test_multiple_badtlas(self):
+        fixed = CleanerUtils.tla_fixer(
+            "Farts Farts Magic (FFG). Magic Beans Tea (MBB). FFG and MBB."
+        )
+        self.assertEqual(
+            "Farts Farts Magic (FFM). Magic Beans Tea (MBT). FFM and MBT.", fixed
+        )